@@ -1,7 +1,145 @@
 """
-Provides functionality for reading from/writing to the 3 index files used by
-indexer and querier in search
+Provides functionality for reading from/writing to the files used by indexer
+and querier in search: the titles, docs and words files, the stems and offsets
+files written next to the words file, the CURRENT pointer of an index
+directory, and indexing checkpoints
 """
+import bz2
+import gzip
+import io
+import itertools
+import os
+import pickle
+import queue
+import shutil
+import tempfile
+import threading
+
+# name of the file in an index directory naming the published version
+CURRENT_FILE = "CURRENT"
+# number of published versions kept in an index directory
+KEEP_VERSIONS = 2
+# openers for compressed wikis, by file extension
+DECOMPRESSORS = {".bz2": bz2.open, ".gz": gzip.open}
+# number of lines joined into each write call
+WRITE_CHUNK_LINES = 4096
+# buffer size of output files
+WRITE_BUFFER_SIZE = 1 << 20
+
+
+class BackgroundReader(io.RawIOBase):
+    """
+    A readable stream that reads another stream on a background thread,
+    handing chunks over through a bounded queue, so decompression overlaps
+    with whatever consumes the data
+    """
+
+    def __init__(self, source, chunk_size: int = 1 << 20, max_chunks: int = 8):
+        """
+        Starts reading source in the background.
+
+        Parameters:
+        source          the binary stream to read, closed with this reader
+        chunk_size      the number of bytes read from source at a time
+        max_chunks      the number of chunks buffered ahead of the consumer
+        """
+        self.source = source
+        self.chunk_size = chunk_size
+        self.chunks = queue.Queue(maxsize=max_chunks)
+        self.chunk = memoryview(b"")
+        self.at_eof = False
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.fill, daemon=True)
+        self.thread.start()
+
+    def fill(self):
+        """
+        Reads source into the queue until EOF, which is queued as b"". Errors
+        are queued to be raised in the consumer, with the EOFError raised for
+        truncated compressed files turned into an IOError.
+        """
+        try:
+            while not self.stopping.is_set():
+                chunk = self.source.read(self.chunk_size)
+                self.chunks.put(chunk)
+                if not chunk:
+                    return
+        except EOFError as e:
+            self.chunks.put(IOError("truncated input: " + str(e)))
+        except Exception as e:
+            self.chunks.put(e)
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if len(self.chunk) == 0 and not self.at_eof:
+            chunk = self.chunks.get()
+            if isinstance(chunk, Exception):
+                raise chunk
+            self.at_eof = not chunk
+            self.chunk = memoryview(chunk)
+        size = min(len(buffer), len(self.chunk))
+        buffer[:size] = self.chunk[:size]
+        self.chunk = self.chunk[size:]
+        return size
+
+    def close(self):
+        if not self.closed:
+            self.stopping.set()
+            # unblock the reading thread if the queue is full
+            while self.thread.is_alive():
+                try:
+                    self.chunks.get_nowait()
+                except queue.Empty:
+                    self.thread.join(0.01)
+            self.source.close()
+        super().close()
+
+
+def write_lines(path: str, lines):
+    """
+    Writes lines (each ending in a newline) to a file, joining them into large
+    chunks so there is one write call per WRITE_CHUNK_LINES lines
+
+    :param path: the file that will get written to
+    :param lines: an iterable of lines
+    :return: n/a
+    """
+    lines = iter(lines)
+    with open(path, "w", buffering=WRITE_BUFFER_SIZE) as out_fh:
+        while True:
+            chunk = "".join(itertools.islice(lines, WRITE_CHUNK_LINES))
+            if chunk == "":
+                return
+            out_fh.write(chunk)
+
+
+def format_words_line(word: str, ids_to_relevance: dict) -> str:
+    """
+    Formats one line of a words file, with a space after every field
+
+    :param word: the word the line is for
+    :param ids_to_relevance: dictionary of page ids to term relevance
+    :return: the line, ending in a newline
+    """
+    return word + " " + "".join([str(id_num) + " " + str(relevance) + " "
+                                 for id_num, relevance in ids_to_relevance.items()]) + "\n"
+
+
+def open_wiki(wiki: str):
+    """
+    Opens a wiki for reading as a binary stream. Wikis ending in .bz2 or .gz
+    are decompressed on a background thread while the caller reads.
+
+    :param wiki: filepath to the wiki, optionally compressed
+    :return: a readable binary stream of the wiki's XML
+    """
+    decompressor = DECOMPRESSORS.get(os.path.splitext(wiki)[1])
+    if decompressor is None:
+        return open(wiki, "rb")
+    return BackgroundReader(decompressor(wiki, "rb"))
+
 
 def write_title_file(title: str, dictionary: dict):
     """
@@ -13,9 +151,8 @@ def write_title_file(title: str, dictionary: dict):
     :param dictionary: a hashmap that maps a page's id to its title
     :return: n/a
     """
-    with open(title, "w") as title_fh:
-        for id_num, title in dictionary.items():
-            title_fh.write(str(id_num) + "::" + title + "\n")
+    write_lines(title, (str(id_num) + "::" + page_title + "\n"
+                        for id_num, page_title in dictionary.items()))
 
 
 def write_document_file(docs: str, ids_to_pageranks: dict):
@@ -30,10 +167,8 @@ def write_document_file(docs: str, ids_to_pageranks: dict):
     :param ids_to_pageranks: dictionary of ids --> pageranks
     :return: n/a
     """
-    with open(docs, "w") as docs_fh:
-        for id_num in ids_to_pageranks.keys():
-            docs_fh.write(str(id_num) + " " + str(ids_to_pageranks[id_num]))
-            docs_fh.write("\n")
+    write_lines(docs, (str(id_num) + " " + str(page_rank) + "\n"
+                       for id_num, page_rank in ids_to_pageranks.items()))
 
 
 def write_words_file(words: str, words_to_doc_relevance: dict):
@@ -48,12 +183,246 @@ def write_words_file(words: str, words_to_doc_relevance: dict):
     :param words_to_doc_relevance: the dictionary that provides words -> ids -> term relevance
     :return: n/a
     """
-    with open(words, "w") as words_fh:
-        for word, ids_to_relevance in words_to_doc_relevance.items():
-            words_fh.write(word + " ")
-            for id_num, relevance in ids_to_relevance.items():
-                words_fh.write(str(id_num) + " " + str(relevance) + " ")
-            words_fh.write("\n")
+    write_lines(words, (format_words_line(word, ids_to_relevance)
+                        for word, ids_to_relevance in words_to_doc_relevance.items()))
+
+def stems_file_for(words: str) -> str:
+    """
+    Returns the path of the stems file that accompanies the given words file
+
+    :param words: filepath to words file
+    :return: filepath to the stems file written next to it
+    """
+    return words + ".stems"
+
+
+def write_stems_file(stems: str, stop_words: set, words_to_stems: dict):
+    """
+    Writes the stop words and the stemming table for the indexed vocabulary so
+    the querier can normalize query words without loading NLTK
+    output looks like:
+    stopword1
+    stopword2
+    word1 stem1
+    word2 stem2
+
+    :param stems: the file that will get written to
+    :param stop_words: the set of stop words used by the indexer
+    :param words_to_stems: dictionary of lowercased words --> stems ("" for stop words)
+    :return: n/a
+    """
+    write_lines(stems, itertools.chain(
+        (word + "\n" for word in sorted(stop_words)),
+        (word + " " + stem + "\n"
+         for word, stem in words_to_stems.items() if stem != "")))
+
+
+def offsets_file_for(words: str) -> str:
+    """
+    Returns the path of the offsets file that accompanies the given words file
+
+    :param words: filepath to words file
+    :return: filepath to the offsets file written next to it
+    """
+    return words + ".offsets"
+
+
+def scan_words_file(words: str, words_to_offsets: dict, words_to_counts: dict):
+    """
+    reads the byte offset of every line in words, and the number of pages each
+    word appears on, without decoding the postings
+
+    :param words: filepath to words file
+    :param words_to_offsets: dictionary that words --> byte offsets get written into
+    :param words_to_counts: dictionary that words --> number of pages get written into
+    :return: n/a
+    """
+    with open(words, "rb") as words_fh:
+        scan_words_stream(words_fh, words_to_offsets, words_to_counts)
+
+
+def scan_words_stream(words_fh, words_to_offsets: dict, words_to_counts: dict):
+    """
+    scan_words_file for a words file that is already open in binary mode,
+    reading it from the start
+
+    :param words_fh: the open words file
+    :param words_to_offsets: dictionary that words --> byte offsets get written into
+    :param words_to_counts: dictionary that words --> number of pages get written into
+    :return: n/a
+    """
+    words_fh.seek(0)
+    offset = 0
+    for line in words_fh:
+        split = line.split()
+        if len(split) > 0:
+            word = split[0].decode()
+            words_to_offsets[word] = offset
+            words_to_counts[word] = (len(split) - 1) // 2
+        offset += len(line)
+
+
+def write_offsets_file(offsets: str, words: str):
+    """
+    Writes the byte offset and page count of each line of an already written
+    words file, so postings can be read on demand, after the size of the
+    words file
+    output looks like:
+    size
+    word1 offset1 count1
+    word2 offset2 count2
+
+    :param offsets: the file that will get written to
+    :param words: filepath to the words file to index
+    :return: n/a
+    """
+    words_to_offsets = {}
+    words_to_counts = {}
+    scan_words_file(words, words_to_offsets, words_to_counts)
+    write_lines(offsets, itertools.chain(
+        [str(os.path.getsize(words)) + "\n"],
+        (word + " " + str(offset) + " " + str(words_to_counts[word]) + "\n"
+         for word, offset in words_to_offsets.items())))
+
+
+def file_fingerprint(path: str) -> tuple:
+    """
+    Returns the size and modification time of a file, used to check that
+    checkpoints were made from the same input
+
+    :param path: filepath to fingerprint
+    :return: a tuple of the format (size, mtime in nanoseconds)
+    """
+    stat = os.stat(path)
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+def write_checkpoint(checkpoint_dir: str, phase: str, state):
+    """
+    Atomically writes the state at the end of an indexing phase as a pickle
+
+    :param checkpoint_dir: the directory holding checkpoints of a run
+    :param phase: the name of the phase
+    :param state: the picklable state to save
+    :return: n/a
+    """
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    path = os.path.join(checkpoint_dir, phase + ".pickle")
+    with open(path + ".tmp", "wb") as checkpoint_fh:
+        pickle.dump(state, checkpoint_fh, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + ".tmp", path)
+
+
+def read_checkpoint(checkpoint_dir: str, phase: str):
+    """
+    reads the state saved at the end of an indexing phase
+
+    :param checkpoint_dir: the directory holding checkpoints of a run
+    :param phase: the name of the phase
+    :return: the saved state, or None if there is no checkpoint for the phase
+    """
+    try:
+        with open(os.path.join(checkpoint_dir, phase + ".pickle"), "rb") as checkpoint_fh:
+            return pickle.load(checkpoint_fh)
+    except FileNotFoundError:
+        return None
+
+
+def remove_checkpoints(checkpoint_dir: str):
+    """
+    Removes all checkpoints of a run
+
+    :param checkpoint_dir: the directory holding checkpoints of a run
+    :return: n/a
+    """
+    shutil.rmtree(checkpoint_dir, ignore_errors=True)
+
+
+def make_staging_dir(index_dir: str) -> str:
+    """
+    Creates an empty directory inside index_dir for the indexer to write a new
+    version into before it is published
+
+    :param index_dir: the directory holding published index versions
+    :return: path to the staging directory
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    return tempfile.mkdtemp(prefix=".staging-", dir=index_dir)
+
+
+def fsync_dir(directory: str):
+    """
+    Flushes every file in directory, and the directory itself, to disk
+
+    :param directory: the directory to flush
+    :return: n/a
+    """
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            with open(path, "rb") as fh:
+                os.fsync(fh.fileno())
+    dir_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def list_versions(index_dir: str) -> list:
+    """
+    Returns the published version names in index_dir, oldest first
+
+    :param index_dir: the directory holding published index versions
+    :return: list of version directory names
+    """
+    return sorted(name for name in os.listdir(index_dir)
+                  if name.startswith("v") and name[1:].isdigit())
+
+
+def publish_version(index_dir: str, staging_dir: str) -> str:
+    """
+    Renames staging_dir to the next version and atomically points CURRENT at
+    it, then removes all but the newest KEEP_VERSIONS versions. Readers that
+    resolve CURRENT see either the old version or the new one, never a mix.
+
+    :param index_dir: the directory holding published index versions
+    :param staging_dir: a fully written directory from make_staging_dir
+    :return: the name of the published version
+    """
+    # the data must be on disk before CURRENT can point at it
+    fsync_dir(staging_dir)
+    versions = list_versions(index_dir)
+    number = int(versions[-1][1:]) + 1 if versions else 1
+    version = "v%06d" % number
+    os.rename(staging_dir, os.path.join(index_dir, version))
+
+    current_tmp = os.path.join(index_dir, CURRENT_FILE + ".tmp")
+    with open(current_tmp, "w") as current_fh:
+        current_fh.write(version + "\n")
+        current_fh.flush()
+        os.fsync(current_fh.fileno())
+    os.replace(current_tmp, os.path.join(index_dir, CURRENT_FILE))
+    fsync_dir(index_dir)
+
+    for old_version in list_versions(index_dir)[:-KEEP_VERSIONS]:
+        shutil.rmtree(os.path.join(index_dir, old_version), ignore_errors=True)
+    return version
+
+
+def read_current_version(index_dir: str) -> str:
+    """
+    reads the name of the published version in index_dir
+
+    :param index_dir: the directory holding published index versions
+    :return: the version name, or None if nothing has been published
+    """
+    try:
+        with open(os.path.join(index_dir, CURRENT_FILE), "r") as current_fh:
+            return current_fh.read().strip() or None
+    except FileNotFoundError:
+        return None
+
 
 def read_title_file(titles: str, ids_to_titles: dict):
     """
@@ -81,10 +450,7 @@ def read_docs_file(docs: str, ids_to_pageranks: dict):
     """
     with open(docs, "r") as docs_fh:
         for line in docs_fh:
-            line = line.strip()
-            if line == "":
-                continue
-            split = line.split(" ")
+            split = line.split()
             if len(split) > 1:
                 ids_to_pageranks[int(split[0])] = float(split[1])
 
@@ -100,14 +466,68 @@ def read_words_file(words: str, words_to_doc_relevance: dict):
     """
     with open(words, "r") as words_fh:
         for line in words_fh:
-            line = line.strip()
-            if line == "":
+            split = line.split()
+            if len(split) == 0:
                 continue
-            split = line.split(" ")
             word = split[0]
-            for i in range(1, len(split), 2):
-                page_id = int(split[i])
-                relevance = float(split[i+1])
-                if word not in words_to_doc_relevance:
-                    words_to_doc_relevance[word] = {}
-                words_to_doc_relevance[word][page_id] = relevance
+            ids_to_relevance = parse_words_line(split)
+            if word in words_to_doc_relevance:
+                words_to_doc_relevance[word].update(ids_to_relevance)
+            elif len(ids_to_relevance) > 0:
+                words_to_doc_relevance[word] = ids_to_relevance
+
+
+def read_stems_file(stems: str, stop_words: set, words_to_stems: dict):
+    """
+    reads the stop words and stemming table written in stems into the
+    stop_words set and words_to_stems dictionary
+
+    :param stems: the file name that the stemming table was written to
+    :param stop_words: the set that stop words will get added to
+    :param words_to_stems: dictionary of lowercased words to stems
+    :return: n/a
+    """
+    with open(stems, "r") as stems_fh:
+        for line in stems_fh:
+            split = line.split()
+            if len(split) == 1:
+                stop_words.add(split[0])
+            elif len(split) > 1:
+                words_to_stems[split[0]] = split[1]
+
+
+def read_offsets_file(offsets: str, words_to_offsets: dict,
+                      words_to_counts: dict) -> int:
+    """
+    reads the offsets and page counts written in offsets into the
+    words_to_offsets and words_to_counts dictionaries
+
+    :param offsets: the file name that the offsets were written to
+    :param words_to_offsets: dictionary of words to byte offsets in the words file
+    :param words_to_counts: dictionary of words to number of pages
+    :return: the size of the words file the offsets were written for, or None
+    if the file does not record it
+    """
+    words_size = None
+    with open(offsets, "r") as offsets_fh:
+        for line in offsets_fh:
+            split = line.split()
+            if len(split) == 3:
+                words_to_offsets[split[0]] = int(split[1])
+                words_to_counts[split[0]] = int(split[2])
+            elif len(split) == 1:
+                words_size = int(split[0])
+    return words_size
+
+
+def parse_words_line(split: list) -> dict:
+    """
+    parses one line of a words file into a dictionary of ids to relevance
+
+    :param split: the whitespace-split fields of a line of the words file,
+    starting with the word
+    :return: dictionary of page ids to term relevance
+    """
+    # ids and relevances alternate after the word
+    return dict(zip(map(int, itertools.islice(split, 1, None, 2)),
+                    map(float, itertools.islice(split, 2, None, 2))))
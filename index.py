@@ -1,8 +1,12 @@
+import itertools
 import math
+import os
 import re
+import shutil
 import sys
 import xml.etree.ElementTree as et
 
+import numpy as np
 from nltk.stem import PorterStemmer
 from nltk.corpus import stopwords
 from tqdm import tqdm
@@ -16,24 +20,38 @@ class Indexer:
     into files that are used by the querier
     """
 
-    def __init__(self, wiki: str, title: str, doc: str, word: str):
+    # attributes filled in by parse, saved in the "parse" checkpoint
+    PARSE_STATE = ("ids_to_titles", "titles_to_ids", "words_to_doc_frequency",
+                   "ids_to_max_counts", "ids_to_links", "words_to_stems")
+
+    def __init__(self, wiki: str, title: str, doc: str, word: str,
+                 index_dir: str = None, checkpoint_dir: str = None,
+                 resume: bool = False):
         """
         The constructor for the indexer.
-        DO NOT MODIFY THIS CONSTRUCTOR.
 
         Note that the output files may be overwritten if they already exist.
+        If index_dir is given, the output files are instead written into a new
+        version directory inside index_dir, which is published atomically.
+        If checkpoint_dir is given, the state after each phase is saved there,
+        and with resume, phases already checkpointed are skipped.
         
         Parameters:
-        wiki        the filename of the input wiki
+        wiki        the filename of the input wiki (plain, .bz2 or .gz)
         title       the output filename of the titles file
         doc         the output filename of the docs file
         word        the output filename of the words file
+        index_dir   optional directory holding published index versions
+        checkpoint_dir  optional directory for checkpoints of a run
+        resume      whether to resume from the checkpoints in checkpoint_dir
         """
 
         # defining epsilon for PageRank calculations
         self.EPSILON = 0.15
         # distance threshold for PageRank calculation
         self.DISTANCE_THRESHOLD = 0.001
+        # PageRank iterations between checkpoints
+        self.CHECKPOINT_INTERVAL = 5
         # set of stop words
         self.STOP_WORDS = set(stopwords.words("english"))
         # porter stemmer
@@ -72,11 +90,19 @@ class Indexer:
         self.ids_to_max_counts = {}
         # id to all the ids that page links to
         self.ids_to_links = {}
+        # id to the titles that page links to, until resolved by resolve_links
+        self.ids_to_link_titles = {}
+        # lowercased token to its stem ("" for stop words), persisted so the
+        # querier does not need NLTK for words that were seen while indexing
+        self.words_to_stems = {}
 
         self.wiki = wiki
         self.title = title
         self.doc = doc
         self.word = word
+        self.index_dir = index_dir
+        self.checkpoint_dir = checkpoint_dir
+        self.resume = resume
 
 
     def run(self):
@@ -85,22 +111,133 @@ class Indexer:
         page rank, and writing the results to the titles/docs/words output
         files
 
-        DO NOT MODIFY THIS METHOD.
+        Output files are written to temporary names and renamed into place, so
+        a reader never sees a half-written file. Only with index_dir does a
+        reader see a consistent set of files: the plain files are renamed one
+        at a time, the stems and offsets files before the words file.
         """
         try:
-            self.parse()
-            words_to_doc_relevance = self.compute_term_relevance()
-            page_rank = self.compute_page_rank()
-            
-            file_io.write_title_file(self.title, self.ids_to_titles)
-            file_io.write_document_file(
-                self.doc, page_rank)
-            file_io.write_words_file(self.word, words_to_doc_relevance)
+            self.start_checkpoints()
+
+            parsed = self.load_checkpoint("parse")
+            if parsed is None:
+                self.parse()
+                self.save_checkpoint("parse", {
+                    name: getattr(self, name) for name in self.PARSE_STATE})
+            else:
+                for name in self.PARSE_STATE:
+                    setattr(self, name, parsed[name])
+
+            words_to_doc_relevance = self.load_checkpoint("relevance")
+            if words_to_doc_relevance is None:
+                words_to_doc_relevance = self.compute_term_relevance()
+                self.save_checkpoint("relevance", words_to_doc_relevance)
+
+            page_rank = self.load_checkpoint("page_rank")
+            if page_rank is None:
+                page_rank = self.compute_page_rank()
+                self.save_checkpoint("page_rank", page_rank)
+
+            if self.index_dir is None:
+                # (temporary path, output path), words file last
+                outputs = [
+                    (file_io.stems_file_for(self.word + ".tmp"),
+                     file_io.stems_file_for(self.word)),
+                    (file_io.offsets_file_for(self.word + ".tmp"),
+                     file_io.offsets_file_for(self.word)),
+                    (self.title + ".tmp", self.title),
+                    (self.doc + ".tmp", self.doc),
+                    (self.word + ".tmp", self.word),
+                ]
+                try:
+                    self.write_files(self.title + ".tmp", self.doc + ".tmp",
+                        self.word + ".tmp", page_rank, words_to_doc_relevance)
+                    for tmp_path, path in outputs:
+                        os.replace(tmp_path, path)
+                finally:
+                    for tmp_path, _ in outputs:
+                        if os.path.exists(tmp_path):
+                            os.remove(tmp_path)
+            else:
+                staging_dir = file_io.make_staging_dir(self.index_dir)
+                try:
+                    self.write_files(
+                        os.path.join(staging_dir, os.path.basename(self.title)),
+                        os.path.join(staging_dir, os.path.basename(self.doc)),
+                        os.path.join(staging_dir, os.path.basename(self.word)),
+                        page_rank, words_to_doc_relevance)
+                    file_io.publish_version(self.index_dir, staging_dir)
+                finally:
+                    # only left behind if writing or publishing failed
+                    shutil.rmtree(staging_dir, ignore_errors=True)
+
+            if self.checkpoint_dir is not None:
+                file_io.remove_checkpoints(self.checkpoint_dir)
         except FileNotFoundError:
             print("One (or more) of the files were not found")
         except IOError:
             print("Error: IO Exception")
 
+    def start_checkpoints(self):
+        """
+        Discards checkpoints unless resuming from checkpoints of the same wiki,
+        which is recorded in a small "manifest" checkpoint
+        """
+        if self.checkpoint_dir is None:
+            return
+        fingerprint = file_io.file_fingerprint(self.wiki)
+        manifest = file_io.read_checkpoint(self.checkpoint_dir, "manifest")
+        if not self.resume or manifest is None or manifest["wiki"] != fingerprint:
+            file_io.remove_checkpoints(self.checkpoint_dir)
+            file_io.write_checkpoint(self.checkpoint_dir, "manifest",
+                                     {"wiki": fingerprint})
+
+    def save_checkpoint(self, phase: str, state):
+        """
+        Saves the state reached at the end of a phase, if checkpointing
+
+        Parameters:
+            phase       the name of the phase
+            state       the picklable state to save
+        """
+        if self.checkpoint_dir is not None:
+            file_io.write_checkpoint(self.checkpoint_dir, phase, state)
+
+    def load_checkpoint(self, phase: str):
+        """
+        Loads the state saved at the end of a phase
+
+        Parameters:
+            phase       the name of the phase
+        Returns:
+            the saved state, or None if not resuming or the phase has no
+            checkpoint
+        """
+        if self.checkpoint_dir is None or not self.resume:
+            return None
+        return file_io.read_checkpoint(self.checkpoint_dir, phase)
+
+    def write_files(self, title: str, doc: str, word: str,
+                    page_rank: dict[int, float],
+                    words_to_doc_relevance: dict[str, dict[int, float]]):
+        """
+        Writes the titles, docs, words, offsets and stems files to the given
+        paths
+
+        Parameters:
+            title                   the output filename of the titles file
+            doc                     the output filename of the docs file
+            word                    the output filename of the words file
+            page_rank               page id to PageRank
+            words_to_doc_relevance  term to page id to term relevance
+        """
+        file_io.write_title_file(title, self.ids_to_titles)
+        file_io.write_document_file(doc, page_rank)
+        file_io.write_words_file(word, words_to_doc_relevance)
+        file_io.write_offsets_file(file_io.offsets_file_for(word), word)
+        file_io.write_stems_file(file_io.stems_file_for(word),
+            self.STOP_WORDS, self.words_to_stems)
+
     def stem_and_stop(self, word: str):
         """
         Checks if word is a stop word, converts it to lowercase, and stems it
@@ -117,6 +254,23 @@ class Indexer:
 
         return self.nltk_ps.stem(word.lower())
 
+    def stem_token(self, word: str) -> str:
+        """
+        Memoized stem_and_stop, recording every lowercased token it sees in
+        words_to_stems so the stemming table can be written alongside the index
+
+        Parameters:
+            word        the word to check
+        Returns:
+            "" if the word is a stop word, the converted word, otherwise
+        """
+        lowered = word.lower()
+        stem = self.words_to_stems.get(lowered)
+        if stem is None:
+            stem = self.stem_and_stop(lowered)
+            self.words_to_stems[lowered] = stem
+        return stem
+
     def word_is_link(self, word: str) -> bool:
         """
         Checks if the word is a link (surrounded by '[[' and ']]')
@@ -165,7 +319,8 @@ class Indexer:
     def process_document(self, title: str, id: int, body: str) -> list[str]:
         """
         Takes in a document title, id, and body, and returns a list of the
-        tokens in the document title and body.
+        tokens in the document title and body. Link destinations are recorded
+        in ids_to_link_titles, to be resolved once every title is known.
 
         A "token" is a word, not including stopwords, that has been stemmed. For
         links, only the link text (not destination) are included in the returned
@@ -186,12 +341,11 @@ class Indexer:
         for words in cool_tokens:
             if self.word_is_link(words):
                 link_text, link_dst = self.split_link(words)
-                if link_dst in self.titles_to_ids:
-                    if id not in self.ids_to_links:
-                        self.ids_to_links[id] = set() 
-                    self.ids_to_links[id].add(self.titles_to_ids[link_dst])
+                if id not in self.ids_to_link_titles:
+                    self.ids_to_link_titles[id] = []
+                self.ids_to_link_titles[id].append(link_dst)
                 for text in link_text:
-                    text_token = self.stem_and_stop(text)
+                    text_token = self.stem_token(text)
                     if text_token != "":
                         val_tokens.append(text_token)
                         if text_token not in self.words_to_doc_frequency:
@@ -202,7 +356,7 @@ class Indexer:
                             self.words_to_doc_frequency[text_token][id] = self.words_to_doc_frequency[text_token][id] + 1
                         
             else:
-                word = self.stem_and_stop(words)
+                word = self.stem_token(words)
                 if word != "":
                     val_tokens.append(word)
                     if word not in self.words_to_doc_frequency:
@@ -223,29 +377,55 @@ class Indexer:
 
     def parse(self):
         """
-        Reads in an xml file, parses titles and ids, tokenizes text, removes
-        stop words, does stemming, and processes links.
+        Reads in an xml file (optionally .bz2 or .gz compressed), parses titles
+        and ids, tokenizes text, removes stop words, does stemming, and
+        processes links.
 
         Updates ids_to_titles, titles_to_ids, words_to_doc_frequency,
         ids_to_max_counts, and ids_to_links
         """
 
-        # load XML + root
-        wiki_tree = et.parse(self.wiki)
-        wiki_xml_root = wiki_tree.getroot()
-
-
-        for wiki_page in wiki_xml_root:
-            page_title = wiki_page.find("title").text.strip()
-            id = (int) (wiki_page.find("id").text.strip())
-            self.ids_to_titles[id] = page_title
-            self.titles_to_ids[page_title] = id
+        # stream the XML a page at a time, so that decompression of .bz2/.gz
+        # wikis on a background thread overlaps with tokenization
+        with file_io.open_wiki(self.wiki) as wiki_fh:
+            depth = 0
+            root = None
+            for event, element in et.iterparse(wiki_fh, events=("start", "end")):
+                if event == "start":
+                    if root is None:
+                        root = element
+                    depth += 1
+                    continue
+                depth -= 1
+                # pages are the children of the root
+                if depth != 1:
+                    continue
+                wiki_page = element
+                page_title = wiki_page.find("title").text.strip()
+                page_id = (int) (wiki_page.find("id").text.strip())
+                self.ids_to_titles[page_id] = page_title
+                self.titles_to_ids[page_title] = page_id
+                body = wiki_page.find("text").text.strip()
+                self.process_document(page_title, int (page_id), body)
+                # drop the finished page so memory does not grow with the wiki
+                root.clear()
+
+        self.resolve_links()
+
+    def resolve_links(self):
+        """
+        Adds the ids of the titles in ids_to_link_titles to ids_to_links,
+        ignoring links to pages that are not in the wiki
 
-        for wiki_page in wiki_xml_root:
-            page_title = wiki_page.find("title").text.strip()
-            page_id = (int) (wiki_page.find("id").text.strip())
-            body = wiki_page.find("text").text.strip()
-            self.process_document(page_title, int (page_id), body)
+        Assumes every page title has been added to titles_to_ids.
+        """
+        for id, link_titles in self.ids_to_link_titles.items():
+            for link_dst in link_titles:
+                if link_dst in self.titles_to_ids:
+                    if id not in self.ids_to_links:
+                        self.ids_to_links[id] = set()
+                    self.ids_to_links[id].add(self.titles_to_ids[link_dst])
+        self.ids_to_link_titles = {}
 
     def compute_tf(self) -> dict[str, dict[int, float]]:
         """
@@ -297,27 +477,73 @@ class Indexer:
         Assumes parse has already been called to populate the relevant data
         structures.
 
+        The raw counts are flattened into parallel arrays (term index, page
+        id, count) and tf, idf and relevance are computed as whole-array
+        operations, giving the same values as compute_tf and compute_idf
+        without building a nested dictionary for each.
+
         Returns:
             a dictionary mapping every every term to a dictionary mapping a page
             id to the relevance metric for that term and page
         """
+        terms, number_docs_with_term, term_index, doc_ids, counts = \
+            self.count_columns()
+        number_documents = len(self.ids_to_titles) # total number of documents
 
-        #compute idf scores
-        idf_scores = self.compute_idf()
-
-        #compute tf scored 
-        tf_scores = self.compute_tf()
-
+        # math.log rather than np.log so idf matches compute_idf exactly
+        idf_scores = np.array([math.log(number_documents / number_docs)
+                               for number_docs in number_docs_with_term.tolist()])
+
+        # map page ids to dense indices once, then gather every pair's max count
+        page_ids = np.fromiter(self.ids_to_max_counts.keys(), dtype=np.int64,
+                               count=len(self.ids_to_max_counts))
+        page_max_counts = np.fromiter(self.ids_to_max_counts.values(),
+                                      dtype=np.int64,
+                                      count=len(self.ids_to_max_counts))
+        page_order = np.argsort(page_ids)
+        page_index = page_order[np.searchsorted(page_ids[page_order], doc_ids)]
+        relevance = (counts / page_max_counts[page_index]) * \
+            idf_scores[term_index]
+        del term_index, doc_ids, counts, page_index
+
+        # pairs are grouped by term, in words_to_doc_frequency order; each
+        # term's slice is converted on its own to avoid full-size lists, and
+        # the page ids are shared with words_to_doc_frequency
+        bounds = np.concatenate(([0], np.cumsum(number_docs_with_term))).tolist()
         term_relevance = {}
-
-        for term, id_to_frequency in tf_scores.items():
-            term_relevance[term] = {}
-            
-            for doc_id, frequency in id_to_frequency.items():
-                term_relevance[term][doc_id] = frequency * idf_scores[term]
+        for i, term in enumerate(terms):
+            term_relevance[term] = dict(zip(
+                self.words_to_doc_frequency[term].keys(),
+                relevance[bounds[i]:bounds[i + 1]].tolist()))
 
         return term_relevance
 
+    def count_columns(self) -> tuple[list[str], np.ndarray, np.ndarray,
+                                     np.ndarray, np.ndarray]:
+        """
+        Flattens words_to_doc_frequency into parallel columns, one entry per
+        (term, page) pair, grouped by term
+
+        Returns:
+            a tuple of the format (terms, number of pages per term, term
+            indices into terms, page ids, counts)
+        """
+        terms = list(self.words_to_doc_frequency.keys())
+        ids_to_counts = list(self.words_to_doc_frequency.values())
+        number_docs_with_term = np.fromiter(map(len, ids_to_counts),
+                                            dtype=np.int64, count=len(terms))
+        number_pairs = int(number_docs_with_term.sum())
+
+        term_index = np.repeat(np.arange(len(terms)), number_docs_with_term)
+        doc_ids = np.fromiter(itertools.chain.from_iterable(ids_to_counts),
+                              dtype=np.int64, count=number_pairs)
+        counts = np.fromiter(
+            itertools.chain.from_iterable(
+                id_to_count.values() for id_to_count in ids_to_counts),
+            dtype=np.int64, count=number_pairs)
+
+        return terms, number_docs_with_term, term_index, doc_ids, counts
+
     def distance(self, dict_a: dict[int, float], dict_b: dict[int, float]) -> float:
         """
         Computes the Euclidean distance between two PageRank dictionaries
@@ -420,16 +646,37 @@ class Indexer:
             rank[id] = 0
             rank_prime[id] = 1/len(self.ids_to_titles.keys())
 
+        iteration = 0
+        resumed = self.load_checkpoint("page_rank_iteration")
+        if resumed is not None:
+            iteration, rank, rank_prime = resumed
 
         while self.distance(rank, rank_prime) > self.DISTANCE_THRESHOLD:
             rank = rank_prime.copy()
             for j in self.ids_to_titles.keys():
                 rank_prime[j] = sum(weights[k][j] * rank[k] for k in rank.keys())
+            iteration += 1
+            if iteration % self.CHECKPOINT_INTERVAL == 0:
+                self.save_checkpoint("page_rank_iteration",
+                                     (iteration, rank, rank_prime))
         return rank_prime
 
 if __name__ == "__main__":
-    if len(sys.argv) == 5:
-        the_indexer = Indexer(*sys.argv[1:])
+    args = sys.argv[1:]
+    options = {}
+    while len(args) > 0 and args[0] in ("--index-dir", "--checkpoint-dir",
+                                        "--resume"):
+        if args[0] == "--resume":
+            options["resume"] = True
+            args = args[1:]
+        elif len(args) > 1:
+            options[args[0][2:].replace("-", "_")] = args[1]
+            args = args[2:]
+        else:
+            break
+    if len(args) == 4 and (options.get("checkpoint_dir") is not None or
+                           not options.get("resume")):
+        the_indexer = Indexer(*args, **options)
         the_indexer.run()
     else:
-        print("Incorrect arguments: use <wiki> <titles> <documents> <words>")
\ No newline at end of file
+        print("Incorrect arguments: use [--index-dir <dir>] [--checkpoint-dir <dir> [--resume]] <wiki> <titles> <documents> <words>")
\ No newline at end of file
@@ -0,0 +1,176 @@
+"""
+Provides a tiered store of posting lists for the querier: frequently used
+posting lists are kept decoded in memory under a byte budget, and the rest are
+read on demand from the words file
+"""
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import file_io
+
+
+def posting_size(ids_to_relevance: dict) -> int:
+    """
+    Estimates the bytes held by a decoded posting list
+
+    :param ids_to_relevance: dictionary of page ids to term relevance
+    :return: approximate size in bytes of the dictionary and its contents
+    """
+    size = sys.getsizeof(ids_to_relevance)
+    for page_id, relevance in ids_to_relevance.items():
+        size += sys.getsizeof(page_id) + sys.getsizeof(relevance)
+    return size
+
+
+class TieredPostings:
+    """
+    A read-only mapping of words to posting lists (page id to relevance) that
+    keeps at most memory_budget bytes of decoded posting lists in memory,
+    evicting the least recently used, and reads the rest from the words file
+    """
+
+    def __init__(self, word_file: str, memory_budget: int):
+        """
+        Opens the words file and loads its offsets, then fills the cache with
+        the posting lists of the words appearing on the most pages.
+
+        Parameters:
+        word_file       the filename of the words file
+        memory_budget   bytes of decoded posting lists to keep in memory
+        """
+        self.memory_budget = memory_budget
+        # word to byte offset of its line in the words file
+        self.words_to_offsets = {}
+        # word to number of pages it appears on
+        self.words_to_counts = {}
+        # word to decoded posting list, least recently used first
+        self.cache = OrderedDict()
+        # word to estimated size of its cached posting list
+        self.cache_sizes = {}
+        self.resident_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+        # kept open so the postings stay readable if the file is replaced
+        self.words_fh = open(word_file, "rb")
+
+        # the offsets file is only trusted if it was written for a words file
+        # of this size
+        offsets_file = file_io.offsets_file_for(word_file)
+        words_size = None
+        if os.path.exists(offsets_file):
+            words_size = file_io.read_offsets_file(
+                offsets_file, self.words_to_offsets, self.words_to_counts)
+        if words_size != os.fstat(self.words_fh.fileno()).st_size:
+            self.scan()
+
+        self.prewarm()
+
+    def prewarm(self):
+        """
+        Caches the posting lists of the words appearing on the most pages,
+        stopping at the first one that does not fit in the budget
+        """
+        for word in sorted(self.words_to_counts, reverse=True,
+                           key=self.words_to_counts.get):
+            ids_to_relevance = self.read_postings(word)
+            if self.resident_bytes + posting_size(ids_to_relevance) > \
+                    self.memory_budget:
+                return
+            self.add_to_cache(word, ids_to_relevance)
+
+    def scan(self):
+        """
+        Rebuilds the offsets and page counts by scanning the open words file
+        """
+        self.words_to_offsets = {}
+        self.words_to_counts = {}
+        file_io.scan_words_stream(
+            self.words_fh, self.words_to_offsets, self.words_to_counts)
+
+    def read_postings(self, word: str) -> dict:
+        """
+        Reads and decodes the posting list of word from the words file,
+        rescanning the words file if the offsets turn out to be stale
+        """
+        split = self.read_line(word).split()
+        if split[:1] != [word]:
+            self.scan()
+            if word not in self.words_to_offsets:
+                return {}
+            split = self.read_line(word).split()
+        return file_io.parse_words_line(split)
+
+    def read_line(self, word: str) -> str:
+        """
+        Reads the line of the words file at the offset of word
+        """
+        self.words_fh.seek(self.words_to_offsets[word])
+        return self.words_fh.readline().decode()
+
+    def add_to_cache(self, word: str, ids_to_relevance: dict):
+        """
+        Caches a posting list, evicting least recently used ones until the
+        cache fits in the budget. Posting lists larger than the whole budget
+        are not cached.
+        """
+        size = posting_size(ids_to_relevance)
+        if size > self.memory_budget:
+            return
+        while self.resident_bytes + size > self.memory_budget:
+            old_word, _ = self.cache.popitem(last=False)
+            self.resident_bytes -= self.cache_sizes.pop(old_word)
+            self.evictions += 1
+        self.cache[word] = ids_to_relevance
+        self.cache_sizes[word] = size
+        self.resident_bytes += size
+
+    def __contains__(self, word) -> bool:
+        return word in self.words_to_offsets
+
+    def __len__(self) -> int:
+        return len(self.words_to_offsets)
+
+    def __getitem__(self, word: str) -> dict:
+        with self.lock:
+            ids_to_relevance = self.cache.get(word)
+            if ids_to_relevance is not None:
+                self.hits += 1
+                self.cache.move_to_end(word)
+                return ids_to_relevance
+            self.misses += 1
+            ids_to_relevance = self.read_postings(word)
+            self.add_to_cache(word, ids_to_relevance)
+            return ids_to_relevance
+
+    def hit_rate(self) -> float:
+        """
+        Returns the fraction of lookups served from memory
+        """
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
+
+    def stats(self) -> dict:
+        """
+        Returns cache statistics for sizing the memory budget
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate(),
+            "evictions": self.evictions,
+            "cached_words": len(self.cache),
+            "total_words": len(self.words_to_offsets),
+            "resident_bytes": self.resident_bytes,
+            "memory_budget": self.memory_budget,
+        }
+
+    def close(self):
+        """
+        Closes the words file
+        """
+        self.words_fh.close()
@@ -1,19 +1,36 @@
 """
 Reads in the files produced by the indexer and runs a search repl
 """
+import os
 import sys
-
-from nltk.stem import PorterStemmer
-from nltk.corpus import stopwords
+import threading
+import time
 
 import file_io
+from postings import TieredPostings
+
+# NLTK is slow to import, so it is only loaded for words missing from the
+# stemming table written by the indexer
+_porter_stemmer = None
+
+
+def porter_stemmer():
+    """
+    Returns a shared PorterStemmer, importing NLTK on first use
+    """
+    global _porter_stemmer
+    if _porter_stemmer is None:
+        from nltk.stem import PorterStemmer
+        _porter_stemmer = PorterStemmer()
+    return _porter_stemmer
 
 
 class Querier:
     # PageRank flag
-    def __init__(self, page_rank: bool, title: str, doc: str, word: str):
+    def __init__(self, page_rank: bool, title: str, doc: str, word: str,
+                 index_dir: str = None, memory_budget: int = None):
         self.page_rank = page_rank
-        # page id to word to num appearances
+        # word to page id to relevance, a TieredPostings if memory_budget is set
         self.words_to_doc_relevance = {}
         # page id to title
         self.ids_to_titles = {}
@@ -21,18 +38,61 @@ class Querier:
         self.ids_to_max_counts = {}
         # id to page rank value
         self.ids_to_pageranks = {}
+        # stop words, None until read from the stems file or NLTK
+        self.stop_words = None
+        # lowercased word to stem ("" for stop words)
+        self.words_to_stems = {}
 
         self.title_file = title
         self.doc_file = doc
         self.word_file = word
 
+        # directory of published index versions (None for plain files)
+        self.index_dir = index_dir
+        # version currently loaded from index_dir
+        self.version = None
+        # held by queries and by the swap to a reloaded index
+        self.swap_lock = threading.Lock()
+        # background thread loading a new version, if any
+        self.reload_thread = None
+        # seconds spent loading the last reloaded version
+        self.last_reload_seconds = None
+        # last version that failed to load, and why, so it is not retried
+        self.failed_version = None
+        self.reload_error = None
+        # bytes of posting lists kept in memory (None to load them all)
+        self.memory_budget = memory_budget
+
     def stem_array(self, word_array: list):
         """
         converts word_array to stemmed
         """
-        s = PorterStemmer()
+        s = porter_stemmer()
         return [s.stem(x) for x in word_array]
 
+    def get_stop_words(self) -> set:
+        """
+        Returns the stop words, loading NLTK's list if no stems file was read
+        """
+        if self.stop_words is None:
+            from nltk.corpus import stopwords
+            self.stop_words = set(stopwords.words('english'))
+        return self.stop_words
+
+    def stem_and_stop(self, word: str) -> str:
+        """
+        Returns "" if word is a stop word and its stem otherwise, using the
+        indexer's stemming table and falling back to NLTK for unseen words
+        """
+        stem = self.words_to_stems.get(word)
+        if stem is None:
+            if word in self.get_stop_words():
+                stem = ""
+            else:
+                stem = porter_stemmer().stem(word)
+            self.words_to_stems[word] = stem
+        return stem
+
     def print_results(self, results: list):
         """
         Prints (up to) the top 10 results
@@ -62,48 +122,152 @@ class Querier:
         """
         Tokenizes query, checks each word for its relevance, ranks results by relevance
         """
-        stop_words = set(stopwords.words('english'))  # stop words
-        # turn query into list of stemmed words (excluding stop words)
-        ps = PorterStemmer()
-        words = [ps.stem(x) for x in user_query.lower().split(
-            " ") if x not in stop_words]
-
-        # map each page where a word is found to its cumulative relevance score
-        self.ids_to_relevance_scores = {}
-
-        # each word in the query is considered separately
-        for word in words:
-            # Only calculate word's contribution to score if it appears in corpus
-            if word in self.words_to_doc_relevance:
-                for page_id, relevance in self.words_to_doc_relevance[word].items():
-                    if page_id not in self.ids_to_relevance_scores:
-                        self.ids_to_relevance_scores[page_id] = 0.0
-                    # each relevant page adds to the score
-                    self.ids_to_relevance_scores[page_id] += relevance
-
-        if len(self.ids_to_relevance_scores) == 0:
-            print("No results")
-            return
+        with self.swap_lock:
+            # turn query into list of stemmed words (excluding stop words)
+            words = [self.stem_and_stop(x) for x in user_query.lower().split(" ")]
+
+            # map each page where a word is found to its cumulative relevance score
+            self.ids_to_relevance_scores = {}
+
+            # each word in the query is considered separately
+            for word in words:
+                # Only calculate word's contribution to score if it appears in corpus
+                if word in self.words_to_doc_relevance:
+                    for page_id, relevance in self.words_to_doc_relevance[word].items():
+                        if page_id not in self.ids_to_relevance_scores:
+                            self.ids_to_relevance_scores[page_id] = 0.0
+                        # each relevant page adds to the score
+                        self.ids_to_relevance_scores[page_id] += relevance
 
-        # list of document ids where some word(s) in the query appeared
-        result_ids = list(self.ids_to_relevance_scores.keys())
+            if len(self.ids_to_relevance_scores) == 0:
+                print("No results")
+                return
+
+            # list of document ids where some word(s) in the query appeared
+            result_ids = list(self.ids_to_relevance_scores.keys())
 
-        # sort the ids based on the relevance in the ids_to_relevance_scores
-        # dictionary
-        result_ids.sort(reverse=True, key=self.ranking_function)
+            # sort the ids based on the relevance in the ids_to_relevance_scores
+            # dictionary
+            result_ids.sort(reverse=True, key=self.ranking_function)
 
-        print("---------" + "\n")
-        self.print_results(result_ids)
-        return result_ids
+            print("---------" + "\n")
+            self.print_results(result_ids)
+            return result_ids
 
     def read_files(self, title_file, doc_file, word_file):
         """
         Read each file into its relevant dictionary
         """
-        file_io.read_title_file(title_file, self.ids_to_titles)
+        self.swap_in(self.load_files(title_file, doc_file, word_file))
+
+    def load_files(self, title_file, doc_file, word_file) -> dict:
+        """
+        Reads each file into fresh dictionaries without touching the ones in
+        use, returning them keyed by the attribute they will replace
+        """
+        index = {
+            "ids_to_titles": {},
+            "ids_to_pageranks": {},
+            "words_to_doc_relevance": {},
+            "stop_words": None,
+            "words_to_stems": {},
+        }
+        file_io.read_title_file(title_file, index["ids_to_titles"])
         file_io.read_docs_file(
-            doc_file, self.ids_to_pageranks)
-        file_io.read_words_file(word_file, self.words_to_doc_relevance)
+            doc_file, index["ids_to_pageranks"])
+        if self.memory_budget is None:
+            file_io.read_words_file(word_file, index["words_to_doc_relevance"])
+        else:
+            index["words_to_doc_relevance"] = TieredPostings(
+                word_file, self.memory_budget)
+        stems_file = file_io.stems_file_for(word_file)
+        if os.path.exists(stems_file):
+            index["stop_words"] = set()
+            file_io.read_stems_file(
+                stems_file, index["stop_words"], index["words_to_stems"])
+        return index
+
+    def swap_in(self, index: dict):
+        """
+        Replaces the dictionaries in use with those from load_files. Queries
+        hold swap_lock, so a query never sees a mix of the old and new index.
+        A replaced TieredPostings is closed once no query can be using it.
+        """
+        with self.swap_lock:
+            old_postings = self.words_to_doc_relevance
+            for name, value in index.items():
+                setattr(self, name, value)
+            if isinstance(old_postings, TieredPostings) and \
+                    old_postings is not self.words_to_doc_relevance:
+                old_postings.close()
+
+    def version_files(self, version: str) -> tuple[str, str, str]:
+        """
+        Returns the titles, docs and words file paths of a published version
+        """
+        version_dir = os.path.join(self.index_dir, version)
+        return (os.path.join(version_dir, os.path.basename(self.title_file)),
+                os.path.join(version_dir, os.path.basename(self.doc_file)),
+                os.path.join(version_dir, os.path.basename(self.word_file)))
+
+    def read_current_version(self):
+        """
+        Reads the version currently published in index_dir
+        """
+        version = file_io.read_current_version(self.index_dir)
+        if version is None:
+            raise FileNotFoundError(self.index_dir)
+        self.read_files(*self.version_files(version))
+        self.version = version
+
+    def check_for_update(self) -> bool:
+        """
+        Starts loading a newly published version in the background, if there
+        is one and no reload is already running. Queries keep using the loaded
+        index until the new one is swapped in.
+
+        Returns:
+            true if a reload was started, false otherwise
+        """
+        if self.index_dir is None:
+            return False
+        if self.reload_thread is not None and self.reload_thread.is_alive():
+            return False
+        version = file_io.read_current_version(self.index_dir)
+        if version is None or version in (self.version, self.failed_version):
+            return False
+        self.reload_thread = threading.Thread(
+            target=self.reload, args=(version,), daemon=True)
+        self.reload_thread.start()
+        return True
+
+    def reload(self, version: str):
+        """
+        Loads a published version and swaps it in. Only to be called by
+        check_for_update. A version that cannot be loaded, for example because
+        it was pruned before it could be read, is recorded in failed_version
+        and not retried.
+        """
+        start = time.perf_counter()
+        try:
+            index = self.load_files(*self.version_files(version))
+        except Exception as e:
+            self.failed_version = version
+            self.reload_error = e
+            return
+        self.swap_in(index)
+        self.version = version
+        self.last_reload_seconds = time.perf_counter() - start
+
+    def print_stats(self):
+        """
+        Prints the posting cache statistics, if a memory budget is in use
+        """
+        if not isinstance(self.words_to_doc_relevance, TieredPostings):
+            print("All postings are in memory")
+            return
+        for name, value in self.words_to_doc_relevance.stats().items():
+            print("\t" + name + " " + str(value))
 
     def search_repl(self):
         """
@@ -116,33 +280,52 @@ class Querier:
             # if ":quit" is reached, exit loop
             if user_query == ":quit":
                 return
+            if user_query == ":stats":
+                self.print_stats()
+                continue
+            # pick up a newly published index, if any
+            self.check_for_update()
             # handle the query
             self.handle_query(user_query)
 
 
 if __name__ == "__main__":
     try:
-        if len(sys.argv) == 5 and sys.argv[1] == "--pagerank":
+        args = sys.argv[1:]
+        index_dir = None
+        memory_budget = None
+        while len(args) > 1 and args[0] in ("--index-dir", "--memory-budget"):
+            if args[0] == "--index-dir":
+                index_dir = args[1]
+            else:
+                # given in megabytes
+                memory_budget = int(float(args[1]) * 1024 * 1024)
+            args = args[2:]
+        if len(args) == 4 and args[0] == "--pagerank":
             page_rank = True
-            title_index = 2
-            doc_index = 3
-            word_index = 4
-        elif len(sys.argv) == 4:
-            page_rank = False
             title_index = 1
             doc_index = 2
             word_index = 3
+        elif len(args) == 3:
+            page_rank = False
+            title_index = 0
+            doc_index = 1
+            word_index = 2
         else:
             print(
-                "Incorrect arguments. Please use [--pagerank] <titleIndex> <documentIndex> <wordIndex>")
+                "Incorrect arguments. Please use [--index-dir <dir>] [--memory-budget <MB>] [--pagerank] <titleIndex> <documentIndex> <wordIndex>")
             sys.exit(1)
         # query
-        title_file = sys.argv[title_index]
-        doc_file = sys.argv[doc_index]
-        word_file = sys.argv[word_index]
+        title_file = args[title_index]
+        doc_file = args[doc_index]
+        word_file = args[word_index]
 
-        myQuerier = Querier(page_rank, title_file, doc_file, word_file)
-        myQuerier.read_files(title_file, doc_file, word_file)
+        myQuerier = Querier(page_rank, title_file, doc_file, word_file,
+                            index_dir, memory_budget)
+        if index_dir is None:
+            myQuerier.read_files(title_file, doc_file, word_file)
+        else:
+            myQuerier.read_current_version()
         myQuerier.search_repl()
     except FileNotFoundError as e:
         print("One (or more) of the files were not found")
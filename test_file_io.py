@@ -0,0 +1,96 @@
+import os
+
+import file_io
+
+
+def write_index(directory, words_to_doc_relevance, words_to_stems=None):
+    """
+    Writes a small index into directory and returns its titles, docs and
+    words file paths
+    """
+    title = os.path.join(directory, "titles.txt")
+    doc = os.path.join(directory, "docs.txt")
+    word = os.path.join(directory, "words.txt")
+    ids = {page_id for postings in words_to_doc_relevance.values()
+           for page_id in postings}
+    file_io.write_title_file(title, {page_id: "Page " + str(page_id)
+                                     for page_id in ids})
+    file_io.write_document_file(doc, {page_id: 1 / len(ids) for page_id in ids})
+    file_io.write_words_file(word, words_to_doc_relevance)
+    if words_to_stems is not None:
+        file_io.write_stems_file(file_io.stems_file_for(word), {"the"},
+                                 words_to_stems)
+    return title, doc, word
+
+
+def test_stems_file_round_trip(tmp_path):
+    stems = str(tmp_path / "words.txt.stems")
+    file_io.write_stems_file(stems, {"the", "a"},
+                             {"running": "run", "the": "", "cats": "cat"})
+    stop_words = set()
+    words_to_stems = {}
+    file_io.read_stems_file(stems, stop_words, words_to_stems)
+    assert stop_words == {"the", "a"}
+    assert words_to_stems == {"running": "run", "cats": "cat"}
+
+
+def publish_index(index_dir, words_to_doc_relevance):
+    """
+    Publishes a small index as a new version in index_dir and returns the
+    version name
+    """
+    staging_dir = file_io.make_staging_dir(index_dir)
+    write_index(staging_dir, words_to_doc_relevance, words_to_stems={})
+    return file_io.publish_version(index_dir, staging_dir)
+
+
+def test_read_current_version_unpublished(tmp_path):
+    assert file_io.read_current_version(str(tmp_path)) is None
+    assert file_io.read_current_version(str(tmp_path / "missing")) is None
+
+
+def test_publish_version_numbers_and_prunes(tmp_path):
+    index_dir = str(tmp_path)
+    assert publish_index(index_dir, {"cat": {1: 0.5}}) == "v000001"
+    assert file_io.read_current_version(index_dir) == "v000001"
+    assert publish_index(index_dir, {"cat": {1: 0.5}}) == "v000002"
+    assert publish_index(index_dir, {"cat": {1: 0.5}}) == "v000003"
+    assert file_io.read_current_version(index_dir) == "v000003"
+    assert file_io.list_versions(index_dir) == \
+        ["v000002", "v000003"][-file_io.KEEP_VERSIONS:]
+    # no staging directories or temporary files are left behind
+    assert sorted(os.listdir(index_dir)) == \
+        sorted([file_io.CURRENT_FILE] + file_io.list_versions(index_dir))
+
+
+def baseline_write_words_file(words, words_to_doc_relevance):
+    """
+    The words file writer before lines were built once and written in chunks
+    """
+    with open(words, "w") as words_fh:
+        for word, ids_to_relevance in words_to_doc_relevance.items():
+            words_fh.write(word + " ")
+            for id_num, relevance in ids_to_relevance.items():
+                words_fh.write(str(id_num) + " " + str(relevance) + " ")
+            words_fh.write("\n")
+
+
+def test_words_file_round_trip(tmp_path, monkeypatch):
+    # more lines than one chunk, and relevances needing full precision
+    monkeypatch.setattr(file_io, "WRITE_CHUNK_LINES", 7)
+    words_to_doc_relevance = {
+        "word" + str(i): {page_id: 1 / (page_id + i + 3) for page_id in range(i % 5 + 1)}
+        for i in range(50)}
+    words_to_doc_relevance["exampl"] = {200: 0.0, 30: 1e-05}
+
+    baseline = str(tmp_path / "baseline.txt")
+    baseline_write_words_file(baseline, words_to_doc_relevance)
+    words = str(tmp_path / "words.txt")
+    file_io.write_words_file(words, words_to_doc_relevance)
+    with open(baseline, "rb") as baseline_fh, open(words, "rb") as words_fh:
+        assert words_fh.read() == baseline_fh.read()
+
+    actual = {}
+    file_io.read_words_file(words, actual)
+    assert actual == words_to_doc_relevance
+    assert list(actual) == list(words_to_doc_relevance)
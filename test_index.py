@@ -1,4 +1,10 @@
+import bz2
+import gzip
+import os
+
 import pytest
+
+import file_io
 from index import Indexer
 
 def setup_function():
@@ -107,3 +113,190 @@ def test_compute_term_relevance():
 'extract': {200: 0.23104906018664842}, 'word': {200: 0.23104906018664842}, \
 'number': {200: 0.23104906018664842}, 'document': {200: 0.23104906018664842}, \
 'link': {30: 0.23104906018664842}, 'see': {30: 0.23104906018664842}}
+
+
+def write_wiki(path, pages):
+    """
+    Writes a wiki of (id, title, text) pages to path
+    """
+    with open(path, "w") as wiki_fh:
+        wiki_fh.write("<xml>\n")
+        for page_id, title, text in pages:
+            wiki_fh.write("<page><title>" + title + "</title><id>" +
+                          str(page_id) + "</id><text>" + text +
+                          "</text></page>\n")
+        wiki_fh.write("</xml>\n")
+
+
+LINKED_PAGES = [
+    (1, "Cats", "cats chase mice, see [[Dogs]] and [[Birds|flying birds]]"),
+    (2, "Dogs", "dogs chase cats [[Cats]] [[Missing page]]"),
+    (3, "Birds", "birds sing songs about [[Cats]] and [[Dogs]]"),
+]
+
+
+def test_run_removes_partial_output_on_error(tmp_path, monkeypatch):
+    wiki = str(tmp_path / "wiki.xml")
+    write_wiki(wiki, LINKED_PAGES)
+
+    def failing_write(*args, **kwargs):
+        raise OSError("disk full")
+    monkeypatch.setattr(file_io, "write_words_file", failing_write)
+
+    Indexer(wiki, str(tmp_path / "t"), str(tmp_path / "d"),
+            str(tmp_path / "w")).run()
+    assert sorted(os.listdir(tmp_path)) == ["wiki.xml"]
+
+    index_dir = tmp_path / "index"
+    Indexer(wiki, "t", "d", "w", index_dir=str(index_dir)).run()
+    assert os.listdir(index_dir) == []
+
+
+def test_compute_term_relevance_matches_tf_idf(tmp_path):
+    wiki = str(tmp_path / "wiki.xml")
+    write_wiki(wiki, LINKED_PAGES)
+    indexer = Indexer(wiki, "t", "d", "w")
+    indexer.parse()
+    tf = indexer.compute_tf()
+    idf = indexer.compute_idf()
+    expected = {term: {page_id: frequency * idf[term]
+                       for page_id, frequency in ids_to_tf.items()}
+                for term, ids_to_tf in tf.items()}
+    actual = indexer.compute_term_relevance()
+    assert actual == expected
+    assert list(actual) == list(expected)
+    assert all(type(page_id) is int and type(relevance) is float
+               for ids_to_relevance in actual.values()
+               for page_id, relevance in ids_to_relevance.items())
+
+
+# page i links to page i + 1, so PageRank needs about 20 iterations
+CHAIN_PAGES = [(i, "Page " + str(i), "text " + str(i) +
+                (" [[Page " + str(i + 1) + "]]" if i < 19 else ""))
+               for i in range(20)]
+
+
+class Crash(Exception):
+    pass
+
+
+def crash_on_distance(monkeypatch, crash_at):
+    """
+    Makes Indexer.distance raise Crash once crash_at PageRank iterations have
+    completed
+    """
+    distance = Indexer.distance
+    calls = {"count": 0}
+
+    def crashing_distance(self, dict_a, dict_b):
+        calls["count"] += 1
+        if calls["count"] == crash_at + 1:
+            raise Crash()
+        return distance(self, dict_a, dict_b)
+    monkeypatch.setattr(Indexer, "distance", crashing_distance)
+
+
+def count_parses(monkeypatch):
+    parse = Indexer.parse
+    calls = {"count": 0}
+
+    def counting_parse(self):
+        calls["count"] += 1
+        parse(self)
+    monkeypatch.setattr(Indexer, "parse", counting_parse)
+    return calls
+
+
+def output_bytes(directory):
+    contents = {}
+    for name in sorted(os.listdir(directory)):
+        with open(os.path.join(directory, name), "rb") as output_fh:
+            contents[name] = output_fh.read()
+    return contents
+
+
+def index_into(wiki, directory, **options):
+    os.makedirs(directory, exist_ok=True)
+    Indexer(wiki, os.path.join(directory, "t"), os.path.join(directory, "d"),
+            os.path.join(directory, "w"), **options).run()
+    return output_bytes(directory)
+
+
+@pytest.mark.parametrize("crash_at", [3, 7])
+def test_resume_after_page_rank_crash(tmp_path, monkeypatch, crash_at):
+    wiki = str(tmp_path / "wiki.xml")
+    write_wiki(wiki, CHAIN_PAGES)
+    expected = index_into(wiki, str(tmp_path / "expected"))
+    checkpoint_dir = str(tmp_path / "checkpoints")
+
+    with monkeypatch.context() as crashing:
+        crash_on_distance(crashing, crash_at)
+        with pytest.raises(Crash):
+            index_into(wiki, str(tmp_path / "resumed"),
+                       checkpoint_dir=checkpoint_dir)
+    saved = file_io.read_checkpoint(checkpoint_dir, "page_rank_iteration")
+    if crash_at < 5:
+        assert saved is None
+    else:
+        assert saved[0] == 5
+
+    parses = count_parses(monkeypatch)
+    resumed = index_into(wiki, str(tmp_path / "resumed"),
+                         checkpoint_dir=checkpoint_dir, resume=True)
+    assert parses["count"] == 0
+    assert resumed == expected
+    assert not os.path.exists(checkpoint_dir)
+
+
+def test_resume_discards_checkpoints_of_changed_wiki(tmp_path, monkeypatch):
+    wiki = str(tmp_path / "wiki.xml")
+    write_wiki(wiki, CHAIN_PAGES)
+    checkpoint_dir = str(tmp_path / "checkpoints")
+    with monkeypatch.context() as crashing:
+        crash_on_distance(crashing, 7)
+        with pytest.raises(Crash):
+            index_into(wiki, str(tmp_path / "resumed"),
+                       checkpoint_dir=checkpoint_dir)
+
+    write_wiki(wiki, LINKED_PAGES)
+    expected = index_into(wiki, str(tmp_path / "expected"))
+    parses = count_parses(monkeypatch)
+    resumed = index_into(wiki, str(tmp_path / "resumed"),
+                         checkpoint_dir=checkpoint_dir, resume=True)
+    assert parses["count"] == 1
+    assert resumed == expected
+
+
+@pytest.mark.parametrize("extension, opener", [(".bz2", bz2.open),
+                                               (".gz", gzip.open)])
+def test_parse_compressed_wiki(tmp_path, extension, opener):
+    wiki = str(tmp_path / "wiki.xml")
+    write_wiki(wiki, LINKED_PAGES)
+    with open(wiki, "rb") as wiki_fh, opener(wiki + extension, "wb") as out_fh:
+        out_fh.write(wiki_fh.read())
+
+    plain = Indexer(wiki, "t", "d", "w")
+    plain.parse()
+    compressed = Indexer(wiki + extension, "t", "d", "w")
+    compressed.parse()
+    # "Cats" links forward to "Dogs" and "Birds"; "Missing page" is dropped
+    assert compressed.ids_to_links == {1: {2, 3}, 2: {1}, 3: {1, 2}}
+    for name in Indexer.PARSE_STATE:
+        assert getattr(compressed, name) == getattr(plain, name)
+        assert list(getattr(compressed, name)) == list(getattr(plain, name))
+
+
+@pytest.mark.parametrize("extension, opener", [(".bz2", bz2.open),
+                                               (".gz", gzip.open)])
+def test_run_reports_truncated_wiki(tmp_path, capsys, extension, opener):
+    wiki = str(tmp_path / ("wiki.xml" + extension))
+    with opener(wiki, "wt") as wiki_fh:
+        wiki_fh.write("<xml>" + "<page><title>x</title></page>" * 1000)
+    with open(wiki, "rb") as wiki_fh:
+        data = wiki_fh.read()
+    with open(wiki, "wb") as wiki_fh:
+        wiki_fh.write(data[:len(data) // 2])
+
+    Indexer(wiki, str(tmp_path / "t"), str(tmp_path / "d"),
+            str(tmp_path / "w")).run()
+    assert "Error: IO Exception" in capsys.readouterr().out
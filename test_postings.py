@@ -0,0 +1,111 @@
+import pytest
+
+import file_io
+from postings import TieredPostings, posting_size
+
+WORDS = {
+    "alpha": {1: 0.5, 2: 0.25, 3: 0.125},
+    "beta": {2: 0.75},
+    "gamma": {3: 1.5},
+    "delta": {1: 0.1, 4: 0.2},
+}
+
+
+def write_words(tmp_path, words_to_doc_relevance):
+    word_file = str(tmp_path / "words.txt")
+    file_io.write_words_file(word_file, words_to_doc_relevance)
+    file_io.write_offsets_file(file_io.offsets_file_for(word_file), word_file)
+    return word_file
+
+
+@pytest.fixture
+def open_postings():
+    """
+    Opens TieredPostings that are closed when the test ends
+    """
+    opened = []
+
+    def open_postings(word_file, memory_budget):
+        opened.append(TieredPostings(word_file, memory_budget))
+        return opened[-1]
+    yield open_postings
+    for postings in opened:
+        postings.close()
+
+
+def read_all(postings, words):
+    return {word: postings[word] for word in words}
+
+
+def test_matches_read_words_file(tmp_path, open_postings):
+    word_file = write_words(tmp_path, WORDS)
+    expected = {}
+    file_io.read_words_file(word_file, expected)
+    for budget in (1, 1 << 20):
+        postings = open_postings(word_file, budget)
+        assert len(postings) == len(expected)
+        assert "missing" not in postings
+        assert read_all(postings, expected) == expected
+        assert postings.resident_bytes <= budget
+    # the tiny budget caches nothing, the large one everything
+    assert len(open_postings(word_file, 1).cache) == 0
+    assert len(open_postings(word_file, 1 << 20).cache) == len(WORDS)
+
+
+def test_lru_eviction_order(tmp_path, open_postings):
+    words = {"a": {1: 0.5}, "b": {2: 0.5}, "c": {3: 0.5}}
+    word_file = write_words(tmp_path, words)
+    postings = open_postings(word_file, 2 * posting_size({1: 0.5}))
+    # prewarmed with the first two words of equal page count
+    assert list(postings.cache) == ["a", "b"]
+
+    postings["c"]
+    assert list(postings.cache) == ["b", "c"]
+    postings["b"]
+    assert list(postings.cache) == ["c", "b"]
+    postings["a"]
+    assert list(postings.cache) == ["b", "a"]
+    assert postings.evictions == 2
+
+
+def test_large_lists_are_not_cached(tmp_path, open_postings):
+    word_file = write_words(tmp_path, WORDS)
+    budget = posting_size(WORDS["delta"])
+    postings = open_postings(word_file, budget)
+    assert postings["alpha"] == WORDS["alpha"]
+    assert postings["alpha"] == WORDS["alpha"]
+    assert "alpha" not in postings.cache
+    assert postings.resident_bytes <= budget
+
+
+def test_hit_and_miss_counters(tmp_path, open_postings):
+    word_file = write_words(tmp_path, WORDS)
+    # prewarming stops at "alpha", which does not fit
+    postings = open_postings(word_file, posting_size(WORDS["beta"]))
+    assert len(postings.cache) == 0
+    postings["beta"]
+    postings["beta"]
+    assert (postings.hits, postings.misses) == (1, 1)
+    assert postings.hit_rate() == 0.5
+    stats = postings.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 1
+    assert stats["total_words"] == len(WORDS)
+
+
+def test_stale_offsets_file_is_ignored(tmp_path, open_postings):
+    word_file = write_words(tmp_path, WORDS)
+    # a different words file of another size, with the old offsets kept
+    file_io.write_words_file(word_file, {"delta": {7: 1.2628643221541278},
+                                         "alpha": {8: 0.5}})
+    postings = open_postings(word_file, 1)
+    assert postings["alpha"] == {8: 0.5}
+    assert "beta" not in postings
+
+
+def test_stale_offsets_of_same_size_are_rescanned(tmp_path, open_postings):
+    word_file = write_words(tmp_path, {"alpha": {1: 0.5}, "beta": {2: 0.5}})
+    # same size, but the lines swapped
+    file_io.write_words_file(word_file, {"beta": {2: 0.5}, "alpha": {1: 0.5}})
+    postings = open_postings(word_file, 1)
+    assert postings["alpha"] == {1: 0.5}
+    assert postings["beta"] == {2: 0.5}
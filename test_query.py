@@ -0,0 +1,106 @@
+import os
+import subprocess
+import sys
+
+import file_io
+from postings import TieredPostings
+from query import Querier
+from test_file_io import publish_index, write_index
+
+
+def test_stem_and_stop_uses_table_without_nltk(tmp_path):
+    files = write_index(str(tmp_path), {"run": {1: 0.5}},
+                        {"running": "run", "the": ""})
+    code = (
+        "import sys\n"
+        "from query import Querier\n"
+        "files = sys.argv[1:]\n"
+        "q = Querier(False, *files)\n"
+        "q.read_files(*files)\n"
+        "assert q.stem_and_stop('running') == 'run'\n"
+        "assert q.stem_and_stop('the') == ''\n"
+        "assert q.handle_query('the running') == [1]\n"
+        "assert 'nltk' not in sys.modules\n"
+    )
+    subprocess.run([sys.executable, "-c", code, *files], check=True,
+                   cwd=os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_stem_and_stop_falls_back_to_nltk(tmp_path):
+    files = write_index(str(tmp_path), {"run": {1: 0.5}}, {"running": "run"})
+    querier = Querier(False, *files)
+    querier.read_files(*files)
+    assert "jumping" not in querier.words_to_stems
+    assert querier.stem_and_stop("jumping") == "jump"
+    assert querier.words_to_stems["jumping"] == "jump"
+    assert querier.stem_and_stop("the") == ""
+
+
+def test_check_for_update_swaps_in_new_version(tmp_path):
+    index_dir = str(tmp_path)
+    publish_index(index_dir, {"cat": {1: 0.5}})
+    querier = Querier(False, "titles.txt", "docs.txt", "words.txt", index_dir)
+    querier.read_current_version()
+    assert querier.version == "v000001"
+    assert querier.check_for_update() is False
+    assert querier.handle_query("cat") == [1]
+
+    publish_index(index_dir, {"cat": {2: 0.5}, "dog": {3: 0.5}})
+    assert querier.check_for_update() is True
+    querier.reload_thread.join()
+    assert querier.version == "v000002"
+    assert querier.last_reload_seconds is not None
+    assert querier.handle_query("cat") == [2]
+    assert querier.handle_query("dog") == [3]
+    assert querier.check_for_update() is False
+
+
+def test_reload_skips_pruned_version(tmp_path):
+    index_dir = str(tmp_path)
+    publish_index(index_dir, {"cat": {1: 0.5}})
+    querier = Querier(False, "titles.txt", "docs.txt", "words.txt", index_dir)
+    querier.read_current_version()
+    for _ in range(file_io.KEEP_VERSIONS + 1):
+        publish_index(index_dir, {"cat": {2: 0.5}})
+    assert "v000002" not in file_io.list_versions(index_dir)
+
+    querier.reload("v000002")
+    assert querier.version == "v000001"
+    assert querier.words_to_doc_relevance == {"cat": {1: 0.5}}
+    assert querier.failed_version == "v000002"
+
+
+def test_failed_version_is_not_retried(tmp_path):
+    index_dir = str(tmp_path)
+    publish_index(index_dir, {"cat": {1: 0.5}})
+    querier = Querier(False, "titles.txt", "docs.txt", "words.txt", index_dir)
+    querier.read_current_version()
+
+    version = publish_index(index_dir, {"cat": {2: 0.5}})
+    with open(os.path.join(index_dir, version, "words.txt"), "w") as words_fh:
+        words_fh.write("cat 2 not-a-number \n")
+    assert querier.check_for_update() is True
+    querier.reload_thread.join()
+    assert querier.version == "v000001"
+    assert querier.failed_version == version
+    assert isinstance(querier.reload_error, ValueError)
+    assert querier.check_for_update() is False
+    assert querier.handle_query("cat") == [1]
+
+
+def test_reload_closes_replaced_tiered_postings(tmp_path):
+    index_dir = str(tmp_path)
+    publish_index(index_dir, {"cat": {1: 0.5}})
+    querier = Querier(False, "titles.txt", "docs.txt", "words.txt", index_dir,
+                      memory_budget=1)
+    querier.read_current_version()
+    old_postings = querier.words_to_doc_relevance
+    assert isinstance(old_postings, TieredPostings)
+
+    publish_index(index_dir, {"cat": {2: 0.5}})
+    assert querier.check_for_update() is True
+    querier.reload_thread.join()
+    assert old_postings.words_fh.closed
+    assert not querier.words_to_doc_relevance.words_fh.closed
+    assert querier.handle_query("cat") == [2]
+    querier.words_to_doc_relevance.close()